@@ -1,7 +1,21 @@
-from telegram import BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ConversationHandler, filters
+import asyncio
+from typing import Any, Awaitable, Coroutine, Optional
+
+from telegram import BotCommand, Update
+from telegram.ext import (
+    Application,
+    BaseUpdateProcessor,
+    CommandHandler,
+    MessageHandler,
+    TypeHandler,
+    CallbackQueryHandler,
+    ConversationHandler,
+    filters,
+)
 
 from config import TELEGRAM_BOT_TOKEN, validate_config
+from outbound import outbox
+from prompts import LLM_BUSY
 from handlers import (
     start,
     help_command,
@@ -18,6 +32,7 @@ from handlers import (
     recommend_followup,
     view,
     cancel,
+    note_activity,
     WAITING_INPUT,
     FILLING_EXERCISE,
     FILLING_SETS,
@@ -27,6 +42,68 @@ from handlers import (
 )
 
 
+MAX_CONCURRENT_UPDATES = 256
+# Updates per user that may be running or waiting their turn; anything beyond that is turned away.
+MAX_QUEUED_UPDATES_PER_USER = 3
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different users concurrently, but each user's updates one at a time, in order.
+
+    ConversationHandler (/track) relies on one user's updates not overlapping, so a plain
+    concurrent_updates(True) would race (double-tapped Confirm, /cancel during an LLM call).
+    An update waits for its user's turn before taking one of the shared slots, and a user with
+    MAX_QUEUED_UPDATES_PER_USER updates already in line gets LLM_BUSY instead of queueing more.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_queued_per_user: int):
+        super().__init__(max_concurrent_updates)
+        self.max_queued_per_user = max_queued_per_user
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiting: dict[int, int] = {}
+
+    async def process_update(self, update: object, coroutine: Coroutine[Any, Any, Any]) -> None:
+        key = _update_owner(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        if self._waiting.get(key, 0) >= self.max_queued_per_user:
+            coroutine.close()
+            if isinstance(update, Update) and update.message:
+                outbox.send(update.message.chat_id, LLM_BUSY)
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            # Per-user lock first, so updates waiting on their own user don't hold shared slots.
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def _update_owner(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
 async def post_init(application: Application) -> None:
     """Register bot commands so they appear when user taps /."""
     await application.bot.set_my_commands([
@@ -39,11 +116,26 @@ async def post_init(application: Application) -> None:
         BotCommand("view", "View past lifts"),
         BotCommand("cancel", "Cancel current action"),
     ])
+    outbox.start(application.bot)
+
+
+async def post_stop(application: Application) -> None:
+    """Flush queued outbound messages before the bot shuts down."""
+    await outbox.stop()
 
 
 def main() -> None:
     validate_config()
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+    # Different users run concurrently so one user's slow LLM call doesn't hold up everyone else;
+    # fairness and per-user limits are enforced by scheduler.llm_scheduler.
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, MAX_QUEUED_UPDATES_PER_USER))
+        .build()
+    )
 
     track_conv = ConversationHandler(
         entry_points=[CommandHandler("track", track_start)],
@@ -66,6 +158,7 @@ def main() -> None:
         ],
     )
 
+    app.add_handler(TypeHandler(Update, note_activity), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("setgoal", setgoal_command))
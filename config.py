@@ -8,6 +8,31 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 SUPABASE_URL = (os.getenv("SUPABASE_URL") or "").strip()
 SUPABASE_SERVICE_KEY = (os.getenv("SUPABASE_SERVICE_KEY") or "").strip()
 
+# LLM scheduler limits. Bucket tokens: a /track parse costs 1, a recommendation costs 3.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_BUCKET_CAPACITY = float(os.getenv("LLM_BUCKET_CAPACITY", "10"))
+LLM_BUCKET_REFILL_PER_MIN = float(os.getenv("LLM_BUCKET_REFILL_PER_MIN", "5"))
+LLM_MAX_PENDING_PER_USER = int(os.getenv("LLM_MAX_PENDING_PER_USER", "1"))
+LLM_MAX_INPUT_CHARS = int(os.getenv("LLM_MAX_INPUT_CHARS", "1000"))
+LLM_MAX_PROMPT_TOKENS = int(os.getenv("LLM_MAX_PROMPT_TOKENS", "6000"))
+
+# Groq circuit breaker: after this many consecutive failures, skip Groq for the cooldown.
+# /recommend falls back to the local program engine (program.py) meanwhile.
+GROQ_CIRCUIT_THRESHOLD = int(os.getenv("GROQ_CIRCUIT_THRESHOLD", "3"))
+GROQ_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("GROQ_CIRCUIT_COOLDOWN_SECONDS", "60"))
+
+# Outbound message limits. Telegram allows ~30 msg/s overall and about 1 msg/s per chat (short bursts are ok).
+OUTBOX_GLOBAL_PER_SEC = float(os.getenv("OUTBOX_GLOBAL_PER_SEC", "25"))
+OUTBOX_CHAT_PER_SEC = float(os.getenv("OUTBOX_CHAT_PER_SEC", "1"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+
+# Speculative /recommend precomputation after /track saves (opt-in).
+PRECOMPUTE_ENABLED = os.getenv("PRECOMPUTE_ENABLED", "").strip().lower() in ("1", "true", "yes")
+PRECOMPUTE_IDLE_SECONDS = float(os.getenv("PRECOMPUTE_IDLE_SECONDS", "600"))
+# Results are keyed on goal + history, so the TTL only bounds memory; a week covers typical gaps between sessions.
+PRECOMPUTE_TTL_SECONDS = float(os.getenv("PRECOMPUTE_TTL_SECONDS", "604800"))
+PRECOMPUTE_BUDGET_PER_HOUR = float(os.getenv("PRECOMPUTE_BUDGET_PER_HOUR", "20"))
+
 
 def validate_config():
     """Raise a clear error if required config is missing."""
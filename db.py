@@ -5,6 +5,9 @@ from typing import Optional
 
 _client: Optional[Client] = None
 
+# Weights are always stored in lbs; convert for display only.
+LBS_TO_KG = 0.453592
+
 
 def get_db() -> Client:
     global _client
@@ -73,3 +76,12 @@ def get_user_lifts(user_id: int, limit: int = 100) -> list[dict]:
     db = get_db()
     result = db.table("lifts").select("*").eq("user_id", user_id).order("created_at", desc=True).limit(limit).execute()
     return result.data or []
+
+
+def serialize_lifts(history: list[dict]) -> list[dict]:
+    """Return lift rows with created_at as an ISO string, so they can be JSON-encoded for prompts."""
+    return [
+        {**h, "created_at": h["created_at"]} if isinstance(h.get("created_at"), str)
+        else {**h, "created_at": h["created_at"].isoformat() if h.get("created_at") else None}
+        for h in history
+    ]
@@ -1,10 +1,25 @@
 from datetime import datetime
+from typing import Optional
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
-from db import ensure_user, set_user_goal, get_user_goal, get_user_unit, set_user_unit, insert_lift, get_user_lifts
-from llm import parse_lift_text, get_workout_recommendation, refine_recommendation
+from db import (
+    ensure_user,
+    set_user_goal,
+    get_user_goal,
+    get_user_unit,
+    set_user_unit,
+    insert_lift,
+    get_user_lifts,
+    serialize_lifts,
+    LBS_TO_KG,
+)
+from llm import parse_lift_text, get_workout_recommendation, groq_available, is_error_reply, refine_recommendation
+from outbound import outbox
+from precompute import precomputer
+from program import DEFAULT_PROFILE, group_hint, match_goal, recommend_program
+from scheduler import Lane, Throttled, llm_scheduler
 from prompts import (
     CANCEL_MESSAGE,
     HELP_MESSAGE,
@@ -32,8 +47,6 @@ from prompts import (
 # Conversation states for /track
 WAITING_INPUT, FILLING_EXERCISE, FILLING_SETS, FILLING_REPS, FILLING_WEIGHT, CONFIRMING = range(6)
 
-LBS_TO_KG = 0.453592
-
 
 def _format_weight(weight_lbs: float, unit: str) -> str:
     """Format weight for display. Weight is always stored in lbs."""
@@ -42,6 +55,11 @@ def _format_weight(weight_lbs: float, unit: str) -> str:
     return f"{weight_lbs} lbs"
 
 
+def _reply(update: Update, text: str, **kwargs) -> None:
+    """Queue a reply to the current chat on the outbound queue (see outbound.py)."""
+    outbox.send(update.effective_chat.id, text, **kwargs)
+
+
 def _format_lift(exercise: str, sets: int, reps: int, weight: float, unit: str = "lbs") -> str:
     return f"{exercise}: {sets}x{reps} @ {_format_weight(weight, unit)}"
 
@@ -50,14 +68,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     ensure_user(user.id, user.username, user.first_name)
     context.user_data.pop("recommend_followup", None)
-    await update.message.reply_text(START_MESSAGE, parse_mode="Markdown")
+    _reply(update, START_MESSAGE, parse_mode="Markdown")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     ensure_user(user.id, user.username, user.first_name)
     context.user_data.pop("recommend_followup", None)
-    await update.message.reply_text(HELP_MESSAGE, parse_mode="Markdown")
+    _reply(update, HELP_MESSAGE, parse_mode="Markdown")
 
 
 async def setunit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -67,9 +85,9 @@ async def setunit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if context.args and context.args[0].lower() in ("lbs", "kg"):
         unit = context.args[0].lower()
         set_user_unit(user.id, unit)
-        await update.message.reply_text(SETUNIT_UPDATED.format(unit=unit), parse_mode="Markdown")
+        _reply(update, SETUNIT_UPDATED.format(unit=unit), parse_mode="Markdown")
     else:
-        await update.message.reply_text(SETUNIT_USAGE, parse_mode="Markdown")
+        _reply(update, SETUNIT_USAGE, parse_mode="Markdown")
 
 
 async def setgoal_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -79,16 +97,17 @@ async def setgoal_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if context.args:
         goal = " ".join(context.args)
         set_user_goal(user.id, goal)
-        await update.message.reply_text(SETGOAL_UPDATED.format(goal=goal), parse_mode="Markdown")
+        precomputer.invalidate(user.id)
+        _reply(update, SETGOAL_UPDATED.format(goal=goal), parse_mode="Markdown")
     else:
-        await update.message.reply_text(SETGOAL_EXAMPLE, parse_mode="Markdown")
+        _reply(update, SETGOAL_EXAMPLE, parse_mode="Markdown")
 
 
 async def track_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     ensure_user(user.id, user.username, user.first_name)
     context.user_data.clear()
-    await update.message.reply_text(TRACK_START)
+    _reply(update, TRACK_START)
     return WAITING_INPUT
 
 
@@ -131,9 +150,15 @@ async def track_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     data = context.user_data
     data["raw"] = text
 
+    try:
+        pending = llm_scheduler.submit(update.effective_user.id, Lane.PARSE, parse_lift_text, text, text=text)
+    except Throttled as e:
+        _reply(update, str(e))
+        return WAITING_INPUT
+
     parsed = []
     try:
-        parsed = parse_lift_text(text) or []
+        parsed = await pending or []
         complete_lifts = _extract_complete_lifts(parsed)
     except (AttributeError, TypeError, ValueError, KeyError):
         complete_lifts = []
@@ -173,7 +198,7 @@ async def track_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     data["missing"] = missing
     data["missing_idx"] = 0
     field = missing[0]
-    await update.message.reply_text(TRACK_FILL[field])
+    _reply(update, TRACK_FILL[field])
     return FILLING_EXERCISE if field == "exercise" else FILLING_SETS if field == "sets" else FILLING_REPS if field == "reps" else FILLING_WEIGHT
 
 
@@ -202,18 +227,18 @@ async def _track_fill_field(update: Update, context: ContextTypes.DEFAULT_TYPE,
     try:
         val = parse_fn(update.message.text)
         if field == "exercise" and not val:
-            await update.message.reply_text(TRACK_INVALID_EXERCISE)
+            _reply(update, TRACK_INVALID_EXERCISE)
             return _get_fill_state(field)
         if field in ("sets", "reps") and (not isinstance(val, int) or val < 1 or val > 100):
-            await update.message.reply_text(TRACK_INVALID_SETS_REPS)
+            _reply(update, TRACK_INVALID_SETS_REPS)
             return _get_fill_state(field)
         if field == "weight" and (val <= 0 or val > 2000):
-            await update.message.reply_text(TRACK_INVALID_WEIGHT)
+            _reply(update, TRACK_INVALID_WEIGHT)
             return _get_fill_state(field)
         data[field] = val
     except (ValueError, TypeError):
         hint = "a number" if field in ("sets", "reps", "weight") else "text"
-        await update.message.reply_text(TRACK_INVALID_GENERIC.format(hint=hint))
+        _reply(update, TRACK_INVALID_GENERIC.format(hint=hint))
         return _get_fill_state(field)
 
     missing = data.get("missing", [])
@@ -221,7 +246,7 @@ async def _track_fill_field(update: Update, context: ContextTypes.DEFAULT_TYPE,
     data["missing_idx"] = idx
     if idx < len(missing):
         next_field = missing[idx]
-        await update.message.reply_text(TRACK_FILL[next_field])
+        _reply(update, TRACK_FILL[next_field])
         return _get_fill_state(next_field)
     return await _show_confirmation(update, context)
 
@@ -241,7 +266,8 @@ async def _show_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE)
     keyboard = [
         [InlineKeyboardButton("✓ Confirm", callback_data="confirm_save"), InlineKeyboardButton("✗ Cancel", callback_data="confirm_cancel")],
     ]
-    await update.message.reply_text(
+    _reply(
+        update,
         TRACK_CONFIRM_QUESTION.format(count=count, summary=summary),
         parse_mode="Markdown",
         reply_markup=InlineKeyboardMarkup(keyboard),
@@ -254,7 +280,7 @@ async def track_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     if query.data == "confirm_cancel":
         context.user_data.clear()
-        await query.edit_message_text(TRACK_CANCELLED)
+        outbox.edit(query.message.chat_id, query.message.message_id, TRACK_CANCELLED)
         return ConversationHandler.END
 
     data = context.user_data
@@ -281,17 +307,16 @@ async def track_confirm_button(update: Update, context: ContextTypes.DEFAULT_TYP
         msg = TRACK_SAVED.format(summary=summary)
 
     context.user_data.clear()
-    await query.edit_message_text(msg, parse_mode="Markdown")
-    await query.message.reply_text(TRACK_CONTINUE_PROMPT)
+    precomputer.schedule(user_id)
+    outbox.edit(query.message.chat_id, query.message.message_id, msg, parse_mode="Markdown")
+    outbox.send(query.message.chat_id, TRACK_CONTINUE_PROMPT)
     return WAITING_INPUT
 
 
-def _serialize_history(history: list) -> list:
-    return [
-        {**h, "created_at": h["created_at"]} if isinstance(h.get("created_at"), str)
-        else {**h, "created_at": h["created_at"].isoformat() if h.get("created_at") else None}
-        for h in history
-    ]
+def _local_fallback(goal: Optional[str], history: list, unit: str, user_request: Optional[str]) -> Optional[str]:
+    """Rule-based workout for when Groq can't answer. None if history is too thin to program from."""
+    profile = match_goal(goal, history) or DEFAULT_PROFILE
+    return recommend_program(profile, history, unit, group=group_hint(user_request))
 
 
 async def recommend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -300,15 +325,45 @@ async def recommend(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_request = " ".join(context.args).strip() if context.args else None
     goal = get_user_goal(user.id)
     history = get_user_lifts(user.id)
-    history_serializable = _serialize_history(history)
-    await update.message.reply_text(RECOMMEND_LOADING)
-    rec = get_workout_recommendation(goal, history_serializable, user_request)
-    await update.message.reply_text(rec, parse_mode="Markdown")
+    history_serializable = serialize_lifts(history)
+    unit = get_user_unit(user.id)
+    rec = None
+    if not user_request:
+        profile = match_goal(goal, history_serializable)
+        if profile:
+            rec = recommend_program(profile, history_serializable, unit)
+        if rec is None:
+            rec = precomputer.take(user.id, goal, history_serializable)
+    # The user is asking now; a precompute still pending for them would only be thrown away.
+    precomputer.invalidate(user.id)
+    if rec is None and not groq_available():
+        # Groq keeps failing; a rule-based workout beats an error message.
+        rec = _local_fallback(goal, history_serializable, unit, user_request)
+    if rec is None:
+        try:
+            pending = llm_scheduler.submit(
+                user.id, Lane.RECOMMEND, get_workout_recommendation, goal, history_serializable, user_request,
+                text=user_request,
+            )
+        except Throttled as e:
+            _reply(update, str(e))
+            return
+        _reply(update, RECOMMEND_LOADING)
+        rec = await pending
+        if is_error_reply(rec):
+            rec = _local_fallback(goal, history_serializable, unit, user_request) or rec
+    _reply(update, rec, parse_mode="Markdown")
     context.user_data["recommend_followup"] = True
     context.user_data["recommend_goal"] = goal
     context.user_data["recommend_history"] = history_serializable
     context.user_data["last_recommendation"] = rec
-    await update.message.reply_text(RECOMMEND_REFINE_PROMPT)
+    _reply(update, RECOMMEND_REFINE_PROMPT)
+
+
+async def note_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs before every other handler. Any interaction restarts the precompute idle timer."""
+    if update.effective_user:
+        precomputer.touch(update.effective_user.id)
 
 
 async def view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -317,7 +372,7 @@ async def view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data.pop("recommend_followup", None)
     lifts = get_user_lifts(user.id)
     if not lifts:
-        await update.message.reply_text(VIEW_EMPTY)
+        _reply(update, VIEW_EMPTY)
         return
     by_date: dict[str, list[dict]] = {}
     for lift in lifts:
@@ -340,9 +395,7 @@ async def view(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             lines.append(f"  • {ex}: {s}x{r} @ {_format_weight(w, unit)}")
         lines.append("")
     text = "\n".join(lines).strip()
-    if len(text) > 4000:
-        text = text[:3997] + "..."
-    await update.message.reply_text(text or "No lifts.", parse_mode="Markdown")
+    _reply(update, text or "No lifts.", parse_mode="Markdown")
 
 
 async def recommend_followup(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -355,14 +408,22 @@ async def recommend_followup(update: Update, context: ContextTypes.DEFAULT_TYPE)
     prev = context.user_data.get("last_recommendation", "")
     goal = context.user_data.get("recommend_goal")
     history = context.user_data.get("recommend_history", [])
-    await update.message.reply_text(RECOMMEND_LOADING)
-    rec = refine_recommendation(goal, history, prev, feedback)
+    try:
+        pending = llm_scheduler.submit(
+            update.effective_user.id, Lane.RECOMMEND, refine_recommendation, goal, history, prev, feedback,
+            text=feedback,
+        )
+    except Throttled as e:
+        _reply(update, str(e))
+        return
+    _reply(update, RECOMMEND_LOADING)
+    rec = await pending
     context.user_data["last_recommendation"] = rec
-    await update.message.reply_text(rec, parse_mode="Markdown")
-    await update.message.reply_text(RECOMMEND_REFINE_PROMPT)
+    _reply(update, rec, parse_mode="Markdown")
+    _reply(update, RECOMMEND_REFINE_PROMPT)
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
-    await update.message.reply_text(CANCEL_MESSAGE)
+    _reply(update, CANCEL_MESSAGE)
     return ConversationHandler.END
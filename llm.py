@@ -1,9 +1,11 @@
 import json
+import threading
+import time
 from typing import Optional
 
 from groq import Groq
 
-from config import GROQ_API_KEY
+from config import GROQ_API_KEY, GROQ_CIRCUIT_COOLDOWN_SECONDS, GROQ_CIRCUIT_THRESHOLD, LLM_MAX_PROMPT_TOKENS
 from prompts import (
     PARSE_LIFT,
     RECOMMEND_BASE_DEFAULT,
@@ -11,26 +13,99 @@ from prompts import (
     RECOMMEND_ERROR,
     RECOMMEND_GOAL_NOT_SET,
     RECOMMEND_HISTORY_EMPTY,
+    RECOMMEND_TOO_LONG,
     RECOMMEND_WORKOUT,
     REFINE_RECOMMENDATION,
 )
 
 
+class GroqUnavailable(Exception):
+    """Raised instead of calling Groq while the circuit is open."""
+
+
+class _CircuitBreaker:
+    """Opens after `threshold` consecutive failed calls and rejects calls for `cooldown` seconds.
+
+    Once the cooldown has passed, calls are let through again; one success closes the circuit.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+_groq_circuit = _CircuitBreaker(GROQ_CIRCUIT_THRESHOLD, GROQ_CIRCUIT_COOLDOWN_SECONDS)
+
+
+def groq_available() -> bool:
+    """False while the Groq circuit is open (recent calls kept failing)."""
+    return not _groq_circuit.is_open()
+
+
 def _get_client() -> Groq:
     return Groq(api_key=GROQ_API_KEY)
 
 
-def parse_lift_text(text: str):
-    """Parse free-form lift text. Returns list of dicts with exercise, sets, reps, weight (or empty list)."""
+def _complete(prompt: str, temperature: float) -> str:
+    """Run a single-prompt chat completion through the circuit breaker."""
+    if _groq_circuit.is_open():
+        raise GroqUnavailable("service temporarily unavailable")
     client = _get_client()
-    prompt = PARSE_LIFT + text
     try:
         response = client.chat.completions.create(
             model="llama-3.3-70b-versatile",
             messages=[{"role": "user", "content": prompt}],
-            temperature=0,
+            temperature=temperature,
         )
-        content = response.choices[0].message.content.strip()
+    except Exception:
+        _groq_circuit.record_failure()
+        raise
+    _groq_circuit.record_success()
+    return response.choices[0].message.content.strip()
+
+
+_ERROR_PREFIX = RECOMMEND_ERROR.split("{error}")[0]
+
+
+def is_error_reply(rec: str) -> bool:
+    """True if a recommendation call returned one of our error messages instead of a workout."""
+    return rec.startswith(_ERROR_PREFIX) or rec == RECOMMEND_TOO_LONG
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars per token), good enough for enforcing a prompt cap."""
+    return len(text) // 4 + 1
+
+
+def _prompt_too_long(prompt: str) -> bool:
+    return _estimate_tokens(prompt) > LLM_MAX_PROMPT_TOKENS
+
+
+def parse_lift_text(text: str):
+    """Parse free-form lift text. Returns list of dicts with exercise, sets, reps, weight (or empty list)."""
+    prompt = PARSE_LIFT + text
+    if _prompt_too_long(prompt):
+        return []
+    try:
+        content = _complete(prompt, temperature=0)
         if content.startswith("```"):
             content = content.split("```")[1]
             if content.startswith("json"):
@@ -49,7 +124,6 @@ def get_workout_recommendation(
     user_goal: Optional[str], lift_history: list, user_request: Optional[str] = None
 ) -> str:
     """Generate a workout recommendation based on goal, history, and optional user request."""
-    client = _get_client()
     history_str = RECOMMEND_HISTORY_EMPTY if not lift_history else json.dumps(lift_history[-20:], indent=2)
     base = RECOMMEND_BASE_WITH_REQUEST.format(user_request=user_request) if user_request else RECOMMEND_BASE_DEFAULT
     prompt = RECOMMEND_WORKOUT.format(
@@ -57,13 +131,10 @@ def get_workout_recommendation(
         user_goal=user_goal or RECOMMEND_GOAL_NOT_SET,
         history_str=history_str,
     )
+    if _prompt_too_long(prompt):
+        return RECOMMEND_TOO_LONG
     try:
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content.strip()
+        return _complete(prompt, temperature=0.7)
     except Exception as e:
         return RECOMMEND_ERROR.format(error=e)
 
@@ -75,7 +146,6 @@ def refine_recommendation(
     user_feedback: str,
 ) -> str:
     """Refine a previous recommendation based on user feedback."""
-    client = _get_client()
     history_str = RECOMMEND_HISTORY_EMPTY if not lift_history else json.dumps(lift_history[-20:], indent=2)
     prompt = REFINE_RECOMMENDATION.format(
         previous_recommendation=previous_recommendation,
@@ -83,12 +153,9 @@ def refine_recommendation(
         user_goal=user_goal or RECOMMEND_GOAL_NOT_SET,
         history_str=history_str,
     )
+    if _prompt_too_long(prompt):
+        return RECOMMEND_TOO_LONG
     try:
-        response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-        )
-        return response.choices[0].message.content.strip()
+        return _complete(prompt, temperature=0.7)
     except Exception as e:
         return RECOMMEND_ERROR.format(error=e)
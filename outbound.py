@@ -0,0 +1,264 @@
+"""Outbound delivery layer for bot messages.
+
+Handlers hand messages to `outbox` instead of awaiting reply_text / edit_message_text.
+A background dispatcher delivers them under a global and a per-chat rate limit, pauses only
+the affected chat when Telegram answers with RetryAfter, merges consecutive replies to the
+same chat, and splits long text at safe boundaries instead of truncating it.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from config import OUTBOX_CHAT_BURST, OUTBOX_CHAT_PER_SEC, OUTBOX_GLOBAL_PER_SEC
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+MERGE_SEPARATOR = "\n\n"
+_MARKDOWN_MARKERS = ("*", "_", "`")
+_MAX_IDLE_CHAT_BUCKETS = 1000
+# Transient network failures are retried with exponential backoff before a message is dropped.
+MAX_SEND_ATTEMPTS = 5
+_NETWORK_BACKOFF_SECONDS = 1.0
+_NETWORK_BACKOFF_MAX_SECONDS = 30.0
+
+
+@dataclass
+class _Outgoing:
+    text: str
+    parse_mode: Optional[str] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    message_id: Optional[int] = None  # set when editing an existing message
+    attempts: int = 0
+
+
+def _is_balanced(text: str) -> bool:
+    return all(text.count(marker) % 2 == 0 for marker in _MARKDOWN_MARKERS)
+
+
+def _find_cut(text: str, limit: int, markdown: bool) -> tuple[int, int]:
+    """Return (end of this chunk, start of the next) for text longer than limit.
+
+    Prefers paragraph breaks, then line breaks, then spaces. For Markdown, a boundary only
+    counts if the chunk before it leaves no *bold*, _italic_ or `code` span open.
+    """
+    fallback = None
+    for sep in ("\n\n", "\n", " "):
+        pos = text.rfind(sep, 0, limit)
+        while pos > 0:
+            if not markdown or _is_balanced(text[:pos]):
+                return pos, pos + len(sep)
+            if fallback is None:
+                fallback = (pos, pos + len(sep))
+            pos = text.rfind(sep, 0, pos)
+    return fallback or (limit, limit)
+
+
+def split_message(text: str, parse_mode: Optional[str] = None, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Split text into chunks of at most `limit` characters at safe boundaries."""
+    chunks = []
+    rest = text
+    while len(rest) > limit:
+        end, start = _find_cut(rest, limit, markdown=parse_mode is not None)
+        chunks.append(rest[:end].rstrip())
+        rest = rest[start:].lstrip("\n")
+    if rest:
+        chunks.append(rest)
+    return chunks or [text]
+
+
+def _retry_seconds(retry_after) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class Outbox:
+    def __init__(self, global_per_sec: float, chat_per_sec: float, chat_burst: float):
+        self.chat_per_sec = chat_per_sec
+        self.chat_burst = chat_burst
+        self._bot: Optional[Bot] = None
+        self._global = TokenBucket(global_per_sec, global_per_sec)
+        # chat_id -> pending messages. Dict order is the round-robin order across chats.
+        self._queues: OrderedDict[int, deque[_Outgoing]] = OrderedDict()
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._blocked_until: dict[int, float] = {}
+        self._busy: set[int] = set()
+        self._inflight: set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def start(self, bot: Bot) -> None:
+        """Start delivering. Must be called from the running event loop (e.g. post_init)."""
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Give pending messages up to `timeout` seconds to go out, then stop the dispatcher."""
+        if self._dispatcher is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._queues or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self._dispatcher.cancel()
+        self._dispatcher = None
+
+    def send(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> None:
+        """Queue a message. Long text is split; reply_markup goes on the last part."""
+        chunks = split_message(text, parse_mode)
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            self._enqueue(chat_id, _Outgoing(chunk, parse_mode, markup))
+
+    def edit(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> None:
+        """Queue an edit of an existing message. Overflow beyond one message is sent as new messages."""
+        chunks = split_message(text, parse_mode)
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            self._enqueue(chat_id, _Outgoing(chunk, parse_mode, markup, message_id if i == 0 else None))
+
+    def _enqueue(self, chat_id: int, msg: _Outgoing) -> None:
+        self._queues.setdefault(chat_id, deque()).append(msg)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= _MAX_IDLE_CHAT_BUCKETS:
+                for cid in [c for c, b in self._chat_buckets.items() if b.is_full() and c not in self._queues]:
+                    del self._chat_buckets[cid]
+            bucket = TokenBucket(self.chat_burst, self.chat_per_sec)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready_chat(self) -> tuple[Optional[int], Optional[float]]:
+        """Return (chat_id, None) for the next chat that may send now, else (None, seconds to wait)."""
+        now = time.monotonic()
+        wait = None
+        for chat_id in self._queues:
+            if chat_id in self._busy:
+                continue
+            blocked = self._blocked_until.get(chat_id, 0) - now
+            if blocked > 0:
+                wait = blocked if wait is None else min(wait, blocked)
+                continue
+            self._blocked_until.pop(chat_id, None)
+            chat_wait = self._chat_bucket(chat_id).wait_time()
+            if chat_wait > 0:
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+            self._queues.move_to_end(chat_id)
+            return chat_id, None
+        return None, wait
+
+    def _pop(self, chat_id: int) -> _Outgoing:
+        """Take the next message for a chat, merging following plain sends into it when they fit."""
+        queue = self._queues[chat_id]
+        msg = queue.popleft()
+        if msg.message_id is None and msg.reply_markup is None:
+            while queue:
+                nxt = queue[0]
+                if nxt.message_id is not None or nxt.parse_mode != msg.parse_mode:
+                    break
+                if len(msg.text) + len(MERGE_SEPARATOR) + len(nxt.text) > MAX_MESSAGE_LENGTH:
+                    break
+                queue.popleft()
+                msg = _Outgoing(msg.text + MERGE_SEPARATOR + nxt.text, msg.parse_mode, nxt.reply_markup)
+                if nxt.reply_markup is not None:
+                    break
+        if not queue:
+            del self._queues[chat_id]
+        return msg
+
+    async def _dispatch(self) -> None:
+        while True:
+            chat_id, wait = self._next_ready_chat()
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            global_wait = self._global.wait_time()
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+            self._global.try_take()
+            self._chat_bucket(chat_id).try_take()
+            msg = self._pop(chat_id)
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, msg))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, chat_id: int, msg: _Outgoing) -> None:
+        try:
+            if msg.message_id is not None:
+                await self._bot.edit_message_text(
+                    msg.text,
+                    chat_id=chat_id,
+                    message_id=msg.message_id,
+                    parse_mode=msg.parse_mode,
+                    reply_markup=msg.reply_markup,
+                )
+            else:
+                await self._bot.send_message(
+                    chat_id, msg.text, parse_mode=msg.parse_mode, reply_markup=msg.reply_markup
+                )
+        except RetryAfter as e:
+            # Only this chat waits; the message goes back to the front of its queue.
+            self._blocked_until[chat_id] = time.monotonic() + _retry_seconds(e.retry_after)
+            self._queues.setdefault(chat_id, deque()).appendleft(msg)
+        except BadRequest as e:  # subclass of NetworkError, so handled first
+            if msg.parse_mode and "parse entities" in str(e).lower():
+                # LLM output with broken Markdown: resend as plain text rather than drop it.
+                msg.parse_mode = None
+                self._queues.setdefault(chat_id, deque()).appendleft(msg)
+            else:
+                logger.warning("Dropping message to chat %s: %s", chat_id, e)
+        except NetworkError as e:
+            # Includes TimedOut. A timed-out send may have gone through, so a retry can duplicate;
+            # that beats silently losing a confirm keyboard or a recommendation.
+            msg.attempts += 1
+            if msg.attempts < MAX_SEND_ATTEMPTS:
+                backoff = min(_NETWORK_BACKOFF_SECONDS * 2 ** (msg.attempts - 1), _NETWORK_BACKOFF_MAX_SECONDS)
+                self._blocked_until[chat_id] = time.monotonic() + backoff
+                self._queues.setdefault(chat_id, deque()).appendleft(msg)
+            else:
+                logger.error("Dropping message to chat %s after %d attempts: %s", chat_id, msg.attempts, e)
+        except TelegramError as e:
+            logger.warning("Dropping message to chat %s: %s", chat_id, e)
+        finally:
+            self._busy.discard(chat_id)
+            self._wakeup.set()
+
+
+outbox = Outbox(
+    global_per_sec=OUTBOX_GLOBAL_PER_SEC,
+    chat_per_sec=OUTBOX_CHAT_PER_SEC,
+    chat_burst=OUTBOX_CHAT_BURST,
+)
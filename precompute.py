@@ -0,0 +1,113 @@
+"""Speculative precomputation of the next default /recommend.
+
+After /track saves lifts, a background task waits for the user to go idle (no interaction with
+the bot for PRECOMPUTE_IDLE_SECONDS), then generates the default recommendation on spare
+scheduler capacity. The result is stored against a key of the user's goal and lift history, so
+a later plain /recommend can answer instantly as long as nothing has changed since. Any new
+save, goal change or /recommend cancels pending work and drops the stored result.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Optional
+
+from config import (
+    PRECOMPUTE_BUDGET_PER_HOUR,
+    PRECOMPUTE_ENABLED,
+    PRECOMPUTE_IDLE_SECONDS,
+    PRECOMPUTE_TTL_SECONDS,
+)
+from db import get_user_goal, get_user_lifts, serialize_lifts
+from llm import get_workout_recommendation, is_error_reply
+from program import match_goal, recommend_program
+from ratelimit import TokenBucket
+from scheduler import NotAdmitted, llm_scheduler
+
+def state_key(goal: Optional[str], history: list[dict]) -> str:
+    """Fingerprint of the inputs to a default recommendation."""
+    ids = [h.get("id") or h.get("created_at") for h in history]
+    return hashlib.sha1(json.dumps([goal, ids], default=str).encode()).hexdigest()
+
+
+class Precomputer:
+    def __init__(self, enabled: bool, idle_seconds: float, ttl_seconds: float, budget_per_hour: float):
+        self.enabled = enabled
+        self.idle_seconds = idle_seconds
+        self.ttl_seconds = ttl_seconds
+        # Global budget of speculative LLM calls, shared by all users.
+        self._budget = TokenBucket(budget_per_hour, budget_per_hour / 3600)
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._last_seen: dict[int, float] = {}  # only tracked for users with a pending task
+        self._results: dict[int, tuple[str, str, float]] = {}  # user_id -> (state key, recommendation, created)
+
+    def schedule(self, user_id: int) -> None:
+        """Called after the user's lifts change. Restarts the idle timer for this user."""
+        self.invalidate(user_id)
+        if not self.enabled:
+            return
+        self._last_seen[user_id] = time.monotonic()
+        self._tasks[user_id] = asyncio.create_task(self._run(user_id))
+
+    def touch(self, user_id: int) -> None:
+        """Record activity from the user, restarting the idle timer of any pending task."""
+        if user_id in self._last_seen:
+            self._last_seen[user_id] = time.monotonic()
+
+    def invalidate(self, user_id: int) -> None:
+        """Cancel pending work and forget any stored result for this user."""
+        task = self._tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+        self._last_seen.pop(user_id, None)
+        self._results.pop(user_id, None)
+
+    def take(self, user_id: int, goal: Optional[str], history: list[dict]) -> Optional[str]:
+        """Return the stored recommendation if it was built from this exact goal and history, else None."""
+        stored = self._results.pop(user_id, None)
+        if stored is None:
+            return None
+        key, rec, created = stored
+        if key != state_key(goal, history) or time.monotonic() - created > self.ttl_seconds:
+            return None
+        return rec
+
+    async def _run(self, user_id: int) -> None:
+        try:
+            while True:
+                idle_left = self._last_seen[user_id] + self.idle_seconds - time.monotonic()
+                if idle_left <= 0:
+                    break
+                await asyncio.sleep(idle_left)
+            del self._last_seen[user_id]  # past the idle wait; later activity doesn't matter
+            goal = await asyncio.to_thread(get_user_goal, user_id)
+            history = serialize_lifts(await asyncio.to_thread(get_user_lifts, user_id))
+            profile = match_goal(goal, history)
+            # Same test as /recommend: skip only if the engine will actually answer (unit doesn't affect that).
+            if profile and recommend_program(profile, history) is not None:
+                return  # /recommend answers these locally (program.py); nothing to precompute
+            # The budget token is taken only when a worker actually starts the job.
+            rec = await llm_scheduler.submit_background(
+                user_id, get_workout_recommendation, goal, history, None, admit=self._budget.try_take
+            )
+            if not is_error_reply(rec):
+                self._results[user_id] = (state_key(goal, history), rec, time.monotonic())
+        except asyncio.CancelledError:
+            raise
+        except NotAdmitted:
+            pass  # global budget spent
+        except Exception:
+            pass  # speculative; a plain /recommend still works without it
+        finally:
+            if self._tasks.get(user_id) is asyncio.current_task():
+                del self._tasks[user_id]
+                self._last_seen.pop(user_id, None)
+
+
+precomputer = Precomputer(
+    # Background jobs only run while a worker stays free for live requests, which needs 2+ workers.
+    enabled=PRECOMPUTE_ENABLED and llm_scheduler.max_concurrency >= 2,
+    idle_seconds=PRECOMPUTE_IDLE_SECONDS,
+    ttl_seconds=PRECOMPUTE_TTL_SECONDS,
+    budget_per_hour=PRECOMPUTE_BUDGET_PER_HOUR,
+)
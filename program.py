@@ -0,0 +1,269 @@
+"""Rule-based program engine: a zero-LLM path for /recommend.
+
+For standard strength goals ("build strength", "add 20 lbs to my bench") a recommendation is
+mostly linear-progression arithmetic on recent top sets, so we do it locally:
+
+- pick the day's muscle group by rotation (the group trained longest ago goes next),
+- estimate each lift's e1RM from its latest top set (Epley) and derive the load for today's reps,
+- add a fixed increment, or deload 10% when e1RM has stalled for three sessions.
+
+Output uses the same bullet format as the RECOMMEND_WORKOUT prompt. Also used as the fallback
+while the Groq circuit is open, for any goal.
+"""
+import math
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from db import LBS_TO_KG
+
+GROUPS = ("push", "pull", "legs")
+
+# Checked in order; first keyword match wins. Anything unmatched is left out of the rotation.
+_GROUP_KEYWORDS = (
+    ("legs", ("squat", "leg", "lunge", "calf", "calves", "romanian", "rdl", "hip thrust", "glute", "hamstring", "quad")),
+    ("pull", ("deadlift", "row", "pull", "chin", "lat", "pulldown", "curl", "shrug", "face pull", "back extension")),
+    (
+        "push",
+        ("bench", "press", "dip", "push", "pushdown", "fly", "flye", "tricep", "extension", "skull crusher",
+         "lateral raise", "chest"),
+    ),
+)
+_ISOLATION_KEYWORDS = ("curl", "raise", "fly", "flye", "extension", "pushdown", "calf", "calves", "shrug", "face pull")
+_LOWER_BODY_GROUPS = ("legs",)
+
+# A goal is programmed locally only if it is about strength and names no other aim.
+_STRENGTH_GOAL = re.compile(r"\b(strength|stronger|powerlift\w*|1 ?rm|one[- ]rep max)\b", re.IGNORECASE)
+_OTHER_GOAL = re.compile(
+    r"\b(fat|lose|losing|loss|cut|cutting|lean|cardio|endurance|run|running|marathon|hypertrophy|bulk|bulking|"
+    r"mass|size|tone|toned|aesthetics?|muscle|muscles|bodyweight|body weight|conditioning|mobility|flexibility)\b",
+    re.IGNORECASE,
+)
+# "add 20 lbs to my bench press" -> phrase "bench press"
+_TARGET_GOAL = re.compile(
+    r"\badd\s+\d+(?:\.\d+)?\s*(?:lbs?|pounds?|kgs?|kilos?)?\s+to\s+"
+    r"(?:(?:my|the|a|an|your|our|his|her|their)\s+)*([a-z][a-z-]*(?:\s+[a-z][a-z-]*){0,2})",
+    re.IGNORECASE,
+)
+# Lifts a target goal may name, most specific first, with the name used to find them in history.
+# No bare "press": "leg press" would otherwise make every press the focus lift.
+_KNOWN_LIFTS = (
+    ("overhead press", "overhead press"),
+    ("ohp", "overhead press"),
+    ("bench", "bench"),
+    ("squat", "squat"),
+    ("deadlift", "deadlift"),
+    ("row", "row"),
+    ("pull-up", "pull-up"),
+    ("chin-up", "chin-up"),
+    ("dip", "dip"),
+    ("clean", "clean"),
+)
+# Words that end the lift name in a target phrase ("bench press by june" -> "bench press").
+_PHRASE_STOPWORDS = ("by", "before", "in", "within", "this", "next", "and", "for", "until", "to", "at")
+_REQUEST_HINTS = (
+    ("legs", ("leg", "lower", "squat")),
+    ("pull", ("pull", "back", "bicep")),
+    ("push", ("push", "chest", "shoulder", "upper", "bench")),
+)
+
+MAIN_REPS = 5
+ACCESSORY_REPS = 10
+MAX_EXERCISES = 5
+STALL_SESSIONS = 3
+DELOAD_FACTOR = 0.9
+# Per-session load increments and rounding, in the user's display unit.
+_INCREMENT = {"lbs": {"upper": 5.0, "lower": 10.0}, "kg": {"upper": 2.5, "lower": 5.0}}
+_ROUND_TO = {"lbs": 5.0, "kg": 2.5}
+
+
+@dataclass(frozen=True)
+class GoalProfile:
+    """A goal the engine can program for. `focus` is a lift the user wants to bring up, if any."""
+
+    kind: str
+    focus: Optional[str] = None
+
+
+DEFAULT_PROFILE = GoalProfile("strength")
+
+
+def _has_word(text: str, keyword: str) -> bool:
+    """Whole-word (optionally plural) match, so "row" doesn't match "narrow"."""
+    return re.search(rf"\b{re.escape(keyword)}(?:e?s)?\b", text) is not None
+
+
+def _normalize(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def _resolve_focus(phrase: str, history: Optional[list[dict]]) -> Optional[str]:
+    """Map the lift named in a target goal to an exercise from history, or else a known lift."""
+    words = []
+    for word in _normalize(phrase).split():
+        if word in _PHRASE_STOPWORDS:
+            break
+        words.append(word)
+    lift = " ".join(words)
+    if not lift:
+        return None
+    for row in history or []:
+        if _has_word(_normalize(str(row.get("exercise") or "")), lift):
+            return lift
+    for keyword, focus in _KNOWN_LIFTS:
+        if _has_word(lift, keyword):
+            return focus
+    return None
+
+
+def match_goal(goal: Optional[str], history: Optional[list[dict]] = None) -> Optional[GoalProfile]:
+    """Return a GoalProfile if the goal is mainly about strength and we can program it locally, else None.
+
+    A target like "add 20 lbs to my bench" sets the focus lift, but only if it names a known lift
+    or an exercise in `history`.
+    """
+    if not goal or _OTHER_GOAL.search(goal):
+        return None
+    target = _TARGET_GOAL.search(goal)
+    focus = _resolve_focus(target.group(1), history) if target else None
+    if focus:
+        return GoalProfile("strength", focus=focus)
+    if _STRENGTH_GOAL.search(goal):
+        return DEFAULT_PROFILE
+    return None
+
+
+def group_hint(text: Optional[str]) -> Optional[str]:
+    """Muscle group named in a free-form request (e.g. "leg day"), if any."""
+    if not text:
+        return None
+    lowered = _normalize(text)
+    for group, keywords in _REQUEST_HINTS:
+        if any(_has_word(lowered, k) for k in keywords):
+            return group
+    return None
+
+
+def _group_for(exercise: str) -> Optional[str]:
+    name = _normalize(exercise)
+    for group, keywords in _GROUP_KEYWORDS:
+        if any(_has_word(name, k) for k in keywords):
+            return group
+    return None
+
+
+def _is_isolation(exercise: str) -> bool:
+    name = _normalize(exercise)
+    return any(_has_word(name, k) for k in _ISOLATION_KEYWORDS)
+
+
+def e1rm(weight: float, reps: int) -> float:
+    """Epley estimated one-rep max."""
+    return weight * (1 + reps / 30) if reps > 1 else weight
+
+
+def _load_for_reps(one_rm: float, reps: int) -> float:
+    return one_rm / (1 + reps / 30) if reps > 1 else one_rm
+
+
+def _round_load(weight: float, unit: str) -> float:
+    step = _ROUND_TO[unit]
+    return max(step, math.floor(weight / step + 0.5) * step)
+
+
+def _format_load(weight: float, unit: str) -> str:
+    return f"{weight:g} {unit}"
+
+
+def _sessions(history: list[dict]) -> dict[str, dict]:
+    """Group lift rows by exercise. Returns name -> {"display", "group", "tops": [(date, weight, reps), ...]}.
+
+    `tops` holds the top set (heaviest, then most reps) of each session, oldest first. Weights are lbs.
+    """
+    by_exercise: dict[str, dict] = {}
+    for row in sorted(history, key=lambda h: str(h.get("created_at") or "")):
+        try:
+            weight, reps = float(row["weight"]), int(row["reps"])
+            name = str(row["exercise"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        key = _normalize(name)
+        if not key or weight <= 0 or reps < 1:
+            continue
+        entry = by_exercise.setdefault(key, {"display": name.strip(), "group": _group_for(name), "tops": []})
+        entry["display"] = name.strip()  # most recent spelling wins
+        date = str(row.get("created_at") or "")[:10]
+        tops = entry["tops"]
+        if tops and tops[-1][0] == date:
+            _, w, r = tops[-1]
+            if (weight, reps) > (w, r):
+                tops[-1] = (date, weight, reps)
+        else:
+            tops.append((date, weight, reps))
+    return by_exercise
+
+
+def _next_group(by_exercise: dict[str, dict]) -> Optional[str]:
+    """The trained group whose last session is oldest."""
+    last_trained: dict[str, str] = {}
+    for entry in by_exercise.values():
+        group = entry["group"]
+        if group and entry["tops"]:
+            last_trained[group] = max(last_trained.get(group, ""), entry["tops"][-1][0])
+    if not last_trained:
+        return None
+    return min(last_trained, key=lambda g: (last_trained[g], GROUPS.index(g)))
+
+
+def _is_stalled(tops: list[tuple]) -> bool:
+    """True if e1RM hasn't improved over the last STALL_SESSIONS sessions at the same or heavier load.
+
+    A lighter latest top set means the user already deloaded, so progression resumes from there.
+    """
+    if len(tops) < STALL_SESSIONS:
+        return False
+    (_, first_w, first_r), (_, last_w, last_r) = tops[-STALL_SESSIONS], tops[-1]
+    return last_w >= first_w and e1rm(last_w, last_r) <= e1rm(first_w, first_r)
+
+
+def _prescribe(entry: dict, unit: str, sets: int, reps: int) -> str:
+    _, weight, last_reps = entry["tops"][-1]
+    if unit == "kg":
+        weight *= LBS_TO_KG
+    load = _load_for_reps(e1rm(weight, last_reps), reps)
+    deload = _is_stalled(entry["tops"])
+    if deload:
+        load *= DELOAD_FACTOR
+    else:
+        body = "lower" if entry["group"] in _LOWER_BODY_GROUPS else "upper"
+        increment = _INCREMENT[unit][body]
+        load += increment / 2 if _is_isolation(entry["display"]) else increment
+    line = f"• *{entry['display']}* — {sets} sets × {reps} reps @ {_format_load(_round_load(load, unit), unit)}"
+    return line + " (deload)" if deload else line
+
+
+def _is_focus(profile: GoalProfile, exercise_key: str) -> bool:
+    return profile.focus is not None and _has_word(exercise_key, profile.focus)
+
+
+def recommend_program(
+    profile: GoalProfile, history: list[dict], unit: str = "lbs", group: Optional[str] = None
+) -> Optional[str]:
+    """Build today's workout from lift history. Returns None if there isn't enough history to program from."""
+    by_exercise = _sessions(history)
+    group = group if group in GROUPS else _next_group(by_exercise)
+    candidates = [(key, e) for key, e in by_exercise.items() if e["group"] == group]
+    if not candidates:
+        return None
+    # Focus lift first, then compounds before isolation work, most recently trained first.
+    candidates.sort(key=lambda item: item[1]["tops"][-1][0], reverse=True)
+    candidates.sort(key=lambda item: (not _is_focus(profile, item[0]), _is_isolation(item[1]["display"])))
+    lines = []
+    for key, entry in candidates[:MAX_EXERCISES]:
+        if _is_focus(profile, key):
+            lines.append(_prescribe(entry, unit, sets=5, reps=MAIN_REPS))
+        elif _is_isolation(entry["display"]):
+            lines.append(_prescribe(entry, unit, sets=3, reps=ACCESSORY_REPS))
+        else:
+            lines.append(_prescribe(entry, unit, sets=3, reps=MAIN_REPS))
+    return "\n".join(lines)
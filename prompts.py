@@ -30,6 +30,7 @@ RECOMMEND_BASE_WITH_REQUEST = 'The user has requested: "{user_request}". Recomme
 RECOMMEND_HISTORY_EMPTY = "No past lifts recorded."
 RECOMMEND_GOAL_NOT_SET = "Not set"
 RECOMMEND_ERROR = "Sorry, I couldn't generate a recommendation right now: {error}"
+RECOMMEND_TOO_LONG = "Sorry, that request is too long for me to handle. Try shorter feedback or start over with /recommend."
 
 REFINE_RECOMMENDATION = """You are a fitness coach. The user received this workout recommendation and wants to adjust it.
 
@@ -104,3 +105,9 @@ VIEW_EMPTY = "No lifts recorded yet. Use /track to log one!"
 RECOMMEND_LOADING = "Generating recommendation..."
 RECOMMEND_REFINE_PROMPT = "Send feedback to adjust the recommendation (e.g. 'make it shorter', 'swap squats for leg press'). Or use /track, /view, etc. to switch."
 CANCEL_MESSAGE = "Cancelled."
+
+# --- LLM scheduler (throttling) ---
+
+LLM_THROTTLED = "Easy there — you're sending requests too fast. Try again in {seconds}s."
+LLM_BUSY = "Still working on your last request. Hang tight!"
+LLM_INPUT_TOO_LONG = "That message is too long ({length} characters). Please keep it under {limit}."
@@ -0,0 +1,37 @@
+import time
+
+
+class TokenBucket:
+    """Token bucket that refills continuously at `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, cost: float = 1.0) -> bool:
+        """Take `cost` tokens if available. Returns False (and takes nothing) otherwise."""
+        self._refill()
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return True
+        return False
+
+    def wait_time(self, cost: float = 1.0) -> float:
+        """Seconds until `cost` tokens will be available."""
+        self._refill()
+        if self._tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self._tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
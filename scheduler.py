@@ -0,0 +1,211 @@
+"""Fair-share scheduler in front of all llm.py calls.
+
+Each user gets a token bucket; requests that would overdraw it (or that are too large, or
+pile up behind an in-flight request) are rejected immediately with a user-facing message
+instead of being queued. Admitted requests wait in priority lanes and are served
+round-robin across users, so one busy user can't starve everyone else. Speculative
+background work (see precompute.py) only runs on capacity nobody else is using.
+"""
+import asyncio
+import math
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Any, Callable, Optional
+
+from config import (
+    LLM_BUCKET_CAPACITY,
+    LLM_BUCKET_REFILL_PER_MIN,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_INPUT_CHARS,
+    LLM_MAX_PENDING_PER_USER,
+)
+from prompts import LLM_BUSY, LLM_INPUT_TOO_LONG, LLM_THROTTLED
+from ratelimit import TokenBucket
+
+_MAX_IDLE_BUCKETS = 1000
+
+
+class Lane(IntEnum):
+    """Priority lanes. Lower values are always served first."""
+
+    PARSE = 0
+    RECOMMEND = 1
+    BACKGROUND = 2  # speculative work; only runs on spare capacity, see _next_job
+
+
+# Bucket tokens charged per request. /track parses are short, recommendations are long 70B completions.
+LANE_COST = {
+    Lane.PARSE: 1.0,
+    Lane.RECOMMEND: 3.0,
+}
+
+
+class Throttled(Exception):
+    """Raised by LLMScheduler.submit when a request is rejected. str(e) is the reply for the user."""
+
+
+class NotAdmitted(Exception):
+    """Set on a background job's future when its admit check refused it at start time."""
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        max_concurrency: int,
+        bucket_capacity: float,
+        refill_per_sec: float,
+        max_pending_per_user: int,
+        max_input_chars: int,
+    ):
+        self.max_concurrency = max_concurrency
+        self.bucket_capacity = bucket_capacity
+        self.refill_per_sec = refill_per_sec
+        self.max_pending_per_user = max_pending_per_user
+        self.max_input_chars = max_input_chars
+        # lane -> user_id -> queued jobs. Dict order is the round-robin order.
+        self._lanes: dict[Lane, OrderedDict[int, deque]] = {lane: OrderedDict() for lane in Lane}
+        self._buckets: dict[int, TokenBucket] = {}
+        self._pending: dict[int, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: list[asyncio.Task] = []
+        self._active = 0
+
+    def submit(self, user_id: int, lane: Lane, fn: Callable[..., Any], *args, text: Optional[str] = None) -> asyncio.Future:
+        """Queue fn(*args) to run in a worker thread. Returns a future with its result.
+
+        Raises Throttled right away (before anything is queued) if the user is over their limits.
+        `text` is the raw user input that will end up in the prompt, checked against the size cap.
+        """
+        if text and len(text) > self.max_input_chars:
+            raise Throttled(LLM_INPUT_TOO_LONG.format(length=len(text), limit=self.max_input_chars))
+        if self._pending.get(user_id, 0) >= self.max_pending_per_user:
+            raise Throttled(LLM_BUSY)
+        bucket = self._get_bucket(user_id)
+        cost = LANE_COST[lane]
+        if not bucket.try_take(cost):
+            raise Throttled(LLM_THROTTLED.format(seconds=math.ceil(bucket.wait_time(cost))))
+
+        future = self._enqueue(user_id, lane, fn, args)
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        future.add_done_callback(lambda _: self._release(user_id))
+        return future
+
+    def submit_background(
+        self, user_id: int, fn: Callable[..., Any], *args, admit: Optional[Callable[[], bool]] = None
+    ) -> asyncio.Future:
+        """Queue speculative work in the BACKGROUND lane.
+
+        Not charged to the user's bucket or pending count; callers budget it themselves through
+        `admit`, which is called when a worker is about to start the job. If it returns False the
+        job is skipped and its future raises NotAdmitted.
+        """
+        return self._enqueue(user_id, Lane.BACKGROUND, fn, args, admit)
+
+    def _enqueue(
+        self, user_id: int, lane: Lane, fn: Callable[..., Any], args: tuple, admit: Optional[Callable[[], bool]] = None
+    ) -> asyncio.Future:
+        self._ensure_workers()
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].setdefault(user_id, deque()).append((fn, args, future, admit))
+        self._wakeup.set()
+        return future
+
+    def _get_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                self._prune_buckets()
+            bucket = TokenBucket(self.bucket_capacity, self.refill_per_sec)
+            self._buckets[user_id] = bucket
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        """Forget users whose bucket has fully refilled; a fresh bucket is identical."""
+        for uid in [uid for uid, b in self._buckets.items() if b.is_full() and uid not in self._pending]:
+            del self._buckets[uid]
+
+    def _release(self, user_id: int) -> None:
+        left = self._pending.get(user_id, 0) - 1
+        if left > 0:
+            self._pending[user_id] = left
+        else:
+            self._pending.pop(user_id, None)
+
+    def _ensure_workers(self) -> None:
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    def _has_spare_capacity(self) -> bool:
+        """True if a background job can run while still leaving a worker free for foreground requests.
+
+        With max_concurrency=1 this is never true, so background work is effectively disabled.
+        """
+        return self._active < self.max_concurrency - 1
+
+    def _next_job(self):
+        """Pop the next job: highest-priority non-empty lane, round-robin across users within it."""
+        for lane in Lane:
+            queue = self._lanes[lane]
+            if lane == Lane.BACKGROUND:
+                self._discard_done(queue)
+            if not queue:
+                continue
+            if lane == Lane.BACKGROUND and not self._has_spare_capacity():
+                return None
+            user_id, jobs = next(iter(queue.items()))
+            job = jobs.popleft()
+            if jobs:
+                queue.move_to_end(user_id)
+            else:
+                del queue[user_id]
+            return job
+        return None
+
+    @staticmethod
+    def _discard_done(queue: OrderedDict) -> None:
+        """Drop jobs whose caller already went away, so they don't sit in the queue waiting for a worker."""
+        for user_id in list(queue):
+            jobs = deque(job for job in queue[user_id] if not job[2].done())
+            if jobs:
+                queue[user_id] = jobs
+            else:
+                del queue[user_id]
+
+    async def _worker(self) -> None:
+        while True:
+            job = self._next_job()
+            if job is None:
+                # Nothing runnable (empty, or only background work waiting for spare capacity).
+                # Woken by the next enqueue or by a worker finishing a job.
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            fn, args, future, admit = job
+            if future.done():  # caller went away while queued
+                continue
+            if admit is not None and not admit():
+                future.set_exception(NotAdmitted())
+                continue
+            self._active += 1
+            try:
+                result = await asyncio.to_thread(fn, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            finally:
+                self._active -= 1
+                self._wakeup.set()  # capacity freed; background work may now be runnable
+            if not future.done():
+                future.set_result(result)
+
+
+llm_scheduler = LLMScheduler(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    bucket_capacity=LLM_BUCKET_CAPACITY,
+    refill_per_sec=LLM_BUCKET_REFILL_PER_MIN / 60,
+    max_pending_per_user=LLM_MAX_PENDING_PER_USER,
+    max_input_chars=LLM_MAX_INPUT_CHARS,
+)